@@ -0,0 +1,121 @@
+#Libraries
+import argparse
+import time
+from concurrent.futures import ProcessPoolExecutor
+import json
+import numpy as np
+import pandas as pd
+from forecasting import BEST_CONFIG_FILE, FORECAST_STEPS, DEFAULT_CONFIG, config_key, describe_config, enrollment_series, fit_forecast
+from loading import DATA_FILE, filter_data, load_data
+
+# Walk-forward backtesting of the enrollment forecast, run offline:
+#   python backtest.py
+# For every filter combination of the dashboard, each candidate model is fitted on the first months of
+# the cumulative enrollment series and scored on the months that follow, moving the cutoff one month
+# at a time. The best configuration per series is saved to forecast_config.json for the dashboard.
+
+CANDIDATE_CONFIGS = [DEFAULT_CONFIG] + [ # The current model comes first so it is kept on ties
+    {"model": "arima", "order": list(order)}
+    for order in [(0, 1, 0), (0, 1, 1), (1, 1, 0), (2, 1, 0), (2, 1, 1), (0, 2, 1), (1, 2, 1)]
+] + [
+    {"model": "holt_winters", "trend": None},
+    {"model": "holt_winters", "trend": "add"},
+    {"model": "holt_winters", "trend": "add", "damped": True},
+    {"model": "holt_winters", "trend": "add", "seasonal": "add"}, # Only on series long enough for a seasonal fold
+]
+MIN_TRAIN_MONTHS = 6 # Shortest history a model is fitted on
+SEASONAL_MIN_TRAIN_MONTHS = 24 # Seasonal Holt-Winters needs two full years
+
+
+# Shortest history a configuration is fitted on
+def first_cutoff(config, min_train=MIN_TRAIN_MONTHS):
+    return max(min_train, SEASONAL_MIN_TRAIN_MONTHS) if config.get("seasonal") else min_train
+
+
+# The candidates that can be scored on at least one fold of a series
+def candidate_configs(series, horizon=FORECAST_STEPS, min_train=MIN_TRAIN_MONTHS):
+    return [config for config in CANDIDATE_CONFIGS if len(series) - horizon >= first_cutoff(config, min_train)]
+
+
+# Walk-forward evaluation of one configuration on one series
+def evaluate(key, series, config, horizon=FORECAST_STEPS, min_train=MIN_TRAIN_MONTHS):
+    errors, actuals, failures = [], [], 0
+    start = time.perf_counter()
+    first = first_cutoff(config, min_train)
+    for cutoff in range(first, len(series) - horizon + 1):
+        try:
+            forecast = fit_forecast(series.iloc[:cutoff], config, steps=horizon)
+        except Exception:
+            failures += 1
+            continue
+        actual = series.iloc[cutoff:cutoff + horizon].values
+        errors.extend(actual - np.asarray(forecast))
+        actuals.extend(actual)
+    errors, actuals = np.array(errors, dtype=float), np.array(actuals, dtype=float)
+    folds = max(len(series) - horizon + 1 - first, 0)
+    return {
+        "Series": key,
+        "Model": describe_config(config),
+        "Config": json.dumps(config),
+        "Folds": folds,
+        "Forecasts": len(errors) // horizon,
+        "Failures": failures,
+        # Only candidates scored on every fold are compared, so a model cannot win by failing on the hard ones
+        "Complete": failures == 0 and len(errors) // horizon == folds > 0,
+        "MAE": np.abs(errors).mean() if len(errors) else np.nan,
+        "RMSE": np.sqrt((errors ** 2).mean()) if len(errors) else np.nan,
+        "MAPE": (np.abs(errors[actuals != 0] / actuals[actuals != 0]).mean() * 100) if (actuals != 0).any() else np.nan,
+        "Seconds": time.perf_counter() - start,
+    }
+
+
+# The monthly cumulative enrollment series of every filter combination with data
+def all_series(data):
+    max_date = pd.to_datetime(data["PtDatabase::EnrollmentDate"]).max().to_period('M')
+    sites = pd.Series(data["Site"].sort_values().unique()).dropna()
+    enrollment_statuses = pd.Series(data["EnrollmentType"].sort_values().unique()).dropna()
+    series = {}
+    for site in ["All"] + list(sites):
+        for enrollment_status in ["All"] + list(enrollment_statuses):
+            filtered_data = filter_data(data, site, enrollment_status)
+            if len(filtered_data) > 0: # The dashboard shows blank graphs otherwise
+                series[config_key(site, enrollment_status)] = enrollment_series(filtered_data, max_date)
+    return series
+
+
+# Evaluate every candidate on every series in a process pool and pick the lowest MAE per series among
+# the candidates scored on all folds (series without such a candidate keep the default model)
+def backtest(data, workers=None, horizon=FORECAST_STEPS, min_train=MIN_TRAIN_MONTHS):
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(evaluate, key, series, config, horizon, min_train)
+            for key, series in all_series(data).items()
+            for config in candidate_configs(series, horizon, min_train)
+        ]
+        results = pd.DataFrame([future.result() for future in futures])
+
+    scored = results[results["Complete"]]
+    best = scored.loc[scored.groupby("Series", sort=False)["MAE"].idxmin()] # idxmin keeps the first candidate on ties
+    best_configs = {row["Series"]: json.loads(row["Config"]) for _, row in best.iterrows()}
+    return results, best_configs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Walk-forward backtest of the enrollment forecast models")
+    parser.add_argument("--data", default=DATA_FILE, help="Export file to backtest on")
+    parser.add_argument("--workers", type=int, default=None, help="Number of processes (default: number of CPUs)")
+    parser.add_argument("--horizon", type=int, default=FORECAST_STEPS, help="Months forecasted at each cutoff")
+    parser.add_argument("--min-train", type=int, default=MIN_TRAIN_MONTHS, help="Shortest history a model is fitted on")
+    parser.add_argument("--output", default=BEST_CONFIG_FILE, help="Where to save the best configuration per series")
+    parser.add_argument("--results", default="backtest_results.csv", help="Where to save the metrics of every candidate")
+    args = parser.parse_args()
+
+    results, best_configs = backtest(load_data(args.data), args.workers, args.horizon, args.min_train)
+    results.to_csv(args.results, index=False)
+    with open(args.output, "w") as config_file:
+        json.dump(best_configs, config_file, indent=2)
+
+    print(results.drop(columns="Config").to_string(index=False, float_format="{:.2f}".format))
+    print()
+    for key, config in best_configs.items():
+        print(f"{key}: {describe_config(config)}")
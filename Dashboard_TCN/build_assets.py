@@ -0,0 +1,119 @@
+#Libraries
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+import urllib.request
+from PIL import Image
+from static_assets import MANIFEST_FILE, STATIC_DIR
+
+# Asset pipeline for the dashboard, run before deploying:
+#   python build_assets.py                   (downloads the Lato font once from Google Fonts)
+#   python build_assets.py --font-dir fonts  (uses Lato files already downloaded, for restricted networks)
+# It writes fingerprinted, precompressed copies of the assets to static/, which the dashboard
+# serves itself with long-lived cache headers instead of loading the font from fonts.googleapis.com
+
+try:
+    import brotli # Optional, gzip is always written
+except ImportError:
+    brotli = None
+
+ASSETS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets")
+FONT_CSS_URL = "https://fonts.googleapis.com/css2?family=Lato:wght@400;700&display=swap"
+# Google Fonts only returns woff2 files to browsers that support them
+FONT_USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/114.0 Safari/537.36"
+FONT_WEIGHTS = {"Regular": 400, "Bold": 700} # Lato-<name>.woff2/.ttf files expected in --font-dir
+LOGO_SIZE = (400, 200) # Twice the size the logo is displayed at in style.css, for high density screens
+COMPRESSED_TYPES = (".css", ".js", ".ttf") # woff2 and png files are already compressed
+
+
+def fingerprint(name, content):
+    root, extension = os.path.splitext(name)
+    return f"{root}.{hashlib.sha256(content).hexdigest()[:10]}{extension}"
+
+
+# Write an asset under its fingerprinted name (with .gz/.br copies for text assets) and return that name
+def write_asset(name, content):
+    built_name = fingerprint(name, content)
+    with open(os.path.join(STATIC_DIR, built_name), "wb") as asset_file:
+        asset_file.write(content)
+    if built_name.endswith(COMPRESSED_TYPES):
+        with open(os.path.join(STATIC_DIR, built_name + ".gz"), "wb") as asset_file:
+            asset_file.write(gzip.compress(content, compresslevel=9, mtime=0))
+        if brotli is not None:
+            with open(os.path.join(STATIC_DIR, built_name + ".br"), "wb") as asset_file:
+                asset_file.write(brotli.compress(content))
+    return built_name
+
+
+def download(url):
+    with urllib.request.urlopen(urllib.request.Request(url, headers={"User-Agent": FONT_USER_AGENT})) as response:
+        return response.read()
+
+
+# Vendor the Lato font files and return the @font-face rules pointing at them
+def build_font_css(font_dir=None):
+    if font_dir is None:
+        font_css = download(FONT_CSS_URL).decode()
+        for url in sorted(set(re.findall(r"url\((https://[^)]+)\)", font_css))):
+            font_css = font_css.replace(url, write_asset("lato" + os.path.splitext(url)[1], download(url)))
+        return font_css
+
+    rules = []
+    for name, weight in FONT_WEIGHTS.items():
+        for extension, font_format in ((".woff2", "woff2"), (".ttf", "truetype")):
+            path = os.path.join(font_dir, f"Lato-{name}{extension}")
+            if os.path.exists(path):
+                with open(path, "rb") as font_file:
+                    built_name = write_asset(os.path.basename(path), font_file.read())
+                rules.append(
+                    "@font-face {\n"
+                    "  font-family: 'Lato';\n"
+                    "  font-style: normal;\n"
+                    f"  font-weight: {weight};\n"
+                    "  font-display: swap;\n"
+                    f"  src: url({built_name}) format('{font_format}');\n"
+                    "}\n"
+                )
+                break
+        else:
+            raise FileNotFoundError(f"Lato-{name}.woff2 or Lato-{name}.ttf not found in {font_dir}")
+    return "".join(rules)
+
+
+# Resize the logo to the size it is displayed at and optimize it
+def build_logo():
+    logo_path = os.path.join(STATIC_DIR, "tcn_logo.png")
+    with Image.open(os.path.join(ASSETS_DIR, "tcn_logo.png")) as logo:
+        logo.thumbnail(LOGO_SIZE, Image.LANCZOS)
+        logo.save(logo_path, optimize=True)
+    with open(logo_path, "rb") as logo_file:
+        content = logo_file.read()
+    os.remove(logo_path)
+    return write_asset("tcn_logo.png", content)
+
+
+def build(font_dir=None):
+    shutil.rmtree(STATIC_DIR, ignore_errors=True) # Drop the assets of the previous build
+    os.makedirs(STATIC_DIR)
+
+    # Bundle the font rules and style.css into a single stylesheet (font urls are relative to it)
+    with open(os.path.join(ASSETS_DIR, "style.css"), "rb") as style_file:
+        style = build_font_css(font_dir).encode() + style_file.read()
+
+    manifest = {
+        "style.css": write_asset("style.css", style),
+        "tcn_logo.png": build_logo(),
+    }
+    with open(os.path.join(STATIC_DIR, MANIFEST_FILE), "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+    return manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the fingerprinted and compressed dashboard assets")
+    parser.add_argument("--font-dir", help="Directory with Lato-Regular and Lato-Bold .woff2 or .ttf files (skips the download)")
+    print(json.dumps(build(parser.parse_args().font_dir), indent=2))
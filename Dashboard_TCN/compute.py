@@ -0,0 +1,293 @@
+#Libraries
+import hashlib
+import json
+import os
+import re
+import tempfile
+import numpy as np
+import pandas as pd
+import statsmodels
+from forecasting import MIN_MONTH, config_for, cumulative_series, enrollment_series, fit_forecast
+from loading import filter_data
+
+# Data loading, aggregation and forecasting shared by the Dash app (dashboard.py) and the notebook
+# (Dashboard_Jupyter.ipynb). Results are cached on disk, keyed by the content of the data, the filter
+# combination and the forecast configuration, so the server and notebook sessions reuse each other's work.
+# Each version of the code and data gets its own cache subdirectory; only the most recently used ones are kept.
+
+MODULE_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.environ.get("COMPUTE_CACHE_DIR", os.path.join(MODULE_DIR, ".compute_cache"))
+CACHE_GENERATIONS = 4 # Number of code/data versions kept in the cache
+SOURCE_FILES = ["compute.py", "forecasting.py", "loading.py"] # Code the aggregates depend on
+
+
+# Hash of the aggregation code and library versions, so changing either invalidates the cache
+def code_version():
+    version = hashlib.sha256(json.dumps([pd.__version__, np.__version__, statsmodels.__version__]).encode())
+    for name in SOURCE_FILES:
+        with open(os.path.join(MODULE_DIR, name), "rb") as source_file:
+            version.update(source_file.read())
+    return version.hexdigest()
+
+
+CODE_VERSION = code_version()
+
+
+# Hash of the content of the data, used in the cache keys
+def data_fingerprint(data):
+    fingerprint = hashlib.sha256(json.dumps(list(map(str, data.columns))).encode())
+    fingerprint.update(pd.util.hash_pandas_object(data, index=False).values.tobytes())
+    return fingerprint.hexdigest()
+
+
+# Count dates per month from MIN_MONTH to max_date, with all earlier dates in a first "2021 (all)" bar
+def monthly_counts(dates, max_date):
+    return month_bars(dates.dt.to_period('M').value_counts(), max_date)
+
+
+# Same bars from counts per month (e.g. summed over chunks of the data)
+def month_bars(month_counts, max_date):
+    # Generate a range of months from the minimum to maximum dates
+    months = pd.period_range(MIN_MONTH, max_date, freq='M')
+    labels = ["2021 (all)"] + list(months.astype(str))
+    # Prepend with value for 2021, with zero for months without dates
+    values = [int(month_counts[month_counts.index < pd.Period(MIN_MONTH, freq='M')].sum())] + list(month_counts.reindex(months, fill_value=0).astype(int))
+    return labels, values
+
+
+# Compute every aggregate and the enrollment forecast shown on the dashboard for one filter combination
+# (None when no records match the filters)
+def compute_aggregates(data, site, enrollment_status, forecast_configs):
+    filtered_data = filter_data(data, site, enrollment_status) # Apply the site and enrollment status filters
+    if len(filtered_data) == 0:
+        return None
+    enrolled_data = filtered_data[filtered_data['Enrolled']]
+    # Months are shown up to the last enrollment in the whole data
+    max_date = pd.to_datetime(data["PtDatabase::EnrollmentDate"]).max().to_period('M')
+
+    screening_dates, screening_counts = monthly_counts(filtered_data["ScreeningDate"], max_date)
+    enrolled_dates, enrolled_counts = monthly_counts(pd.to_datetime(enrolled_data["PtDatabase::EnrollmentDate"]), max_date)
+
+    # Running sum of enrollment counts for each month and its forecast
+    # (with the model selected by backtest.py for this filter combination, ARIMA(1, 1, 1) by default)
+    cumulative_enrollment = enrollment_series(filtered_data, max_date)
+    forecast_config = config_for(forecast_configs, site, enrollment_status)
+    forecast = fit_forecast(cumulative_enrollment, forecast_config)
+
+    # Conversion from screening to enrollment
+    total_screened = filtered_data["ScreeningDate"].notna().sum()
+    converted_participants = enrolled_data["ScreeningDate"].notna().sum()
+
+    return {
+        "screening_dates": screening_dates,
+        "screening_counts": screening_counts,
+        "enrolled_dates": enrolled_dates,
+        "enrolled_counts": enrolled_counts,
+        "cumulative_enrollment": cumulative_enrollment,
+        "forecast": forecast,
+        "forecast_config": forecast_config,
+        "enrollment_counts": enrolled_data["EnrollmentType"].value_counts(),
+        "pid_status_counts": enrolled_data["PtDatabase::PIDStatus"].value_counts(),
+        "referral_source_counts": filtered_data["ReferralSource"].value_counts(),
+        "moudtype_counts": enrolled_data["MOUDType"].value_counts(),
+        "oudscore_counts": filtered_data["OUDScore"].value_counts(),
+        "days_incarcerated": filtered_data["DaysIncarcerated"].abs(), # Absolute values (no negative)
+        "age_mean": round(filtered_data["Age"].mean()),
+        "race_counts": filtered_data["Race"].value_counts(),
+        "gender_counts": filtered_data["Gender"].value_counts(),
+        "conversion_rate": round((converted_participants / total_screened) * 100), # Rounded to 0 decimal places
+        "site_counts": enrolled_data["Site"].value_counts(),
+    }
+
+
+# Cache subdirectory for this version of the code and data
+def cache_generation(fingerprint):
+    return os.path.join(CACHE_DIR, hashlib.sha256((CODE_VERSION + fingerprint).encode()).hexdigest()[:16])
+
+
+def cache_path(generation, site, enrollment_status, forecast_config):
+    key = json.dumps([site, enrollment_status, forecast_config], sort_keys=True)
+    return os.path.join(generation, hashlib.sha256(key.encode()).hexdigest() + ".pkl")
+
+
+# Names of the entries this cache creates: generation subdirectories, and result files (plus their
+# temporary files) inside them or directly in CACHE_DIR for the older flat layout
+GENERATION_NAME = re.compile(r"[0-9a-f]{16}")
+RESULT_NAME = re.compile(r"[0-9a-f]{64}\.pkl|tmp\w+\.tmp")
+
+
+# Delete the result files of a generation subdirectory, and the subdirectory if nothing else is left in it
+def remove_generation(path):
+    for entry in os.scandir(path):
+        if entry.is_file() and RESULT_NAME.fullmatch(entry.name):
+            os.remove(entry.path)
+    try:
+        os.rmdir(path)
+    except OSError:
+        pass # Not empty: it holds files this cache did not create
+
+
+# Delete all but the CACHE_GENERATIONS most recently used cache subdirectories. Only entries named like
+# the ones this cache creates are touched, since COMPUTE_CACHE_DIR may point to a shared directory
+def prune_cache():
+    entries = list(os.scandir(CACHE_DIR))
+    for entry in entries:
+        if entry.is_file() and RESULT_NAME.fullmatch(entry.name):
+            os.remove(entry.path) # Files left from the older flat cache layout
+    generations = sorted(
+        (entry for entry in entries if entry.is_dir() and GENERATION_NAME.fullmatch(entry.name)),
+        key=lambda entry: entry.stat().st_mtime,
+        reverse=True,
+    )
+    for entry in generations[CACHE_GENERATIONS:]:
+        try:
+            remove_generation(entry.path)
+        except FileNotFoundError:
+            pass # Already pruned by another process
+
+
+# Same as compute_aggregates, reading and writing the on-disk cache
+# (pass the data fingerprint when calling repeatedly to avoid hashing the data each time,
+# and use_cache=False to always compute, e.g. when profiling the computation)
+def cached_aggregates(data, site, enrollment_status, forecast_configs, fingerprint=None, use_cache=True):
+    if not use_cache:
+        return compute_aggregates(data, site, enrollment_status, forecast_configs)
+    if fingerprint is None:
+        fingerprint = data_fingerprint(data)
+    generation = cache_generation(fingerprint)
+    if os.path.isdir(generation):
+        os.utime(generation) # Mark this version as recently used
+    else:
+        os.makedirs(generation, exist_ok=True)
+        prune_cache() # A new code or data version: drop the least recently used ones
+    path = cache_path(generation, site, enrollment_status, config_for(forecast_configs, site, enrollment_status))
+    if os.path.exists(path):
+        return pd.read_pickle(path)
+
+    aggregates = compute_aggregates(data, site, enrollment_status, forecast_configs)
+    try:
+        # Write to a temporary file first so concurrent readers never see a partial file
+        with tempfile.NamedTemporaryFile(dir=generation, suffix=".tmp", delete=False) as cache_file:
+            pd.to_pickle(aggregates, cache_file)
+        os.replace(cache_file.name, path)
+    except FileNotFoundError:
+        pass # The subdirectory was pruned by another process meanwhile
+    return aggregates
+
+
+# Additive partial aggregates: the counts behind every aggregate, per filter combination. Partials of
+# chunks of the data can be summed, so a large export is aggregated one chunk at a time without keeping
+# its rows (and rows can be subtracted again, see snapshots.py)
+
+COUNTED_COLUMNS = { # Aggregate name: (column, counted for enrolled participants only)
+    "enrollment_counts": ("EnrollmentType", True),
+    "pid_status_counts": ("PtDatabase::PIDStatus", True),
+    "referral_source_counts": ("ReferralSource", False),
+    "moudtype_counts": ("MOUDType", True),
+    "oudscore_counts": ("OUDScore", False),
+    "race_counts": ("Race", False),
+    "gender_counts": ("Gender", False),
+    "site_counts": ("Site", True),
+}
+
+
+# Partial aggregates of some rows of the data for every filter combination present in them
+def partial_aggregates(rows):
+    partials = {}
+    for site in ["All"] + list(rows["Site"].dropna().unique()):
+        for enrollment_status in ["All"] + list(rows["EnrollmentType"].dropna().unique()):
+            filtered_data = filter_data(rows, site, enrollment_status)
+            if len(filtered_data) == 0:
+                continue
+            enrolled_data = filtered_data[filtered_data['Enrolled']]
+            partial = {
+                "rows": len(filtered_data),
+                # Counts per month (all months, the bars and the series are cut to MIN_MONTH - max_date at the end)
+                "all_enrollment_months": pd.to_datetime(filtered_data["PtDatabase::EnrollmentDate"]).dt.to_period('M').value_counts(),
+                "screening_months": filtered_data["ScreeningDate"].dt.to_period('M').value_counts(),
+                "enrolled_months": pd.to_datetime(enrolled_data["PtDatabase::EnrollmentDate"]).dt.to_period('M').value_counts(),
+                "days_incarcerated": filtered_data["DaysIncarcerated"].abs().value_counts(), # Each value is drawn on the box plot
+                "age_sum": filtered_data["Age"].sum(),
+                "age_count": filtered_data["Age"].count(),
+                "total_screened": filtered_data["ScreeningDate"].notna().sum(),
+                "converted_participants": enrolled_data["ScreeningDate"].notna().sum(),
+            }
+            for name, (column, enrolled_only) in COUNTED_COLUMNS.items():
+                partial[name] = (enrolled_data if enrolled_only else filtered_data)[column].value_counts()
+            partials[(site, enrollment_status)] = partial
+    return partials
+
+
+# Add (sign=1) or subtract (sign=-1) partial aggregates into a running total, in place
+def combine_partials(total, partials, sign=1):
+    for key, partial in partials.items():
+        if key not in total:
+            total[key] = {name: sign * value for name, value in partial.items()}
+            continue
+        current = total[key]
+        for name, value in partial.items():
+            if isinstance(value, pd.Series):
+                combined = current[name].add(sign * value, fill_value=0)
+                current[name] = combined[combined != 0].astype("int64") # Drop values no longer present
+            else:
+                current[name] = current[name] + sign * value
+        if current["rows"] == 0:
+            del total[key] # No rows left for this combination
+    return total
+
+
+# Counts sorted like value_counts (ties ordered by value, since the row order is not kept)
+def sorted_counts(counts):
+    return counts.sort_index().sort_values(ascending=False, kind="mergesort")
+
+
+# Last enrollment month of the whole data, from the partial aggregates of all rows
+def partial_max_date(partials):
+    return partials[("All", "All")]["all_enrollment_months"].index.max()
+
+
+# The dashboard aggregates and forecast of one filter combination from its partial aggregates
+# (same result as compute_aggregates, up to the order of tied counts)
+def finish_aggregates(partial, site, enrollment_status, max_date, forecast_configs):
+    screening_dates, screening_counts = month_bars(partial["screening_months"], max_date)
+    enrolled_dates, enrolled_counts = month_bars(partial["enrolled_months"], max_date)
+    cumulative_enrollment = cumulative_series(partial["enrolled_months"], max_date)
+    forecast_config = config_for(forecast_configs, site, enrollment_status)
+    days_incarcerated = partial["days_incarcerated"]
+
+    aggregates = {
+        "screening_dates": screening_dates,
+        "screening_counts": screening_counts,
+        "enrolled_dates": enrolled_dates,
+        "enrolled_counts": enrolled_counts,
+        "cumulative_enrollment": cumulative_enrollment,
+        "forecast": fit_forecast(cumulative_enrollment, forecast_config),
+        "forecast_config": forecast_config,
+        "days_incarcerated": pd.Series(np.repeat(days_incarcerated.index.values, days_incarcerated.values), name="DaysIncarcerated"),
+        "age_mean": round(partial["age_sum"] / partial["age_count"]),
+        "conversion_rate": round((partial["converted_participants"] / partial["total_screened"]) * 100), # Rounded to 0 decimal places
+    }
+    for name in COUNTED_COLUMNS:
+        aggregates[name] = sorted_counts(partial[name])
+    return aggregates
+
+
+# Finish the aggregates of the given filter combinations (all by default). Returns the aggregates and
+# the error of each combination that failed (e.g. its forecast fit), which is left out of the aggregates
+def finish_all(partials, forecast_configs, keys=None):
+    max_date = partial_max_date(partials)
+    aggregates, failed = {}, {}
+    for key in (partials if keys is None else keys):
+        try:
+            aggregates[key] = finish_aggregates(partials[key], *key, max_date, forecast_configs)
+        except Exception as error: # Reported like a failed pre-warm instead of stopping the dashboard
+            failed[key] = error
+    return aggregates, failed
+
+
+# Aggregate an export one chunk at a time: peak memory is one chunk plus the counts
+def stream_aggregates(chunks, forecast_configs):
+    partials = {}
+    for chunk in chunks:
+        combine_partials(partials, partial_aggregates(chunk))
+    return finish_all(partials, forecast_configs)
@@ -3,44 +3,79 @@ import pandas as pd
 from dash import Dash, Input, Output, dcc, html
 import numpy as np
 import statsmodels.api as sm
-from statsmodels.tsa.arima.model import ARIMA
 from statsmodels.tsa.holtwinters import ExponentialSmoothing
 import plotly.express as px
 import plotly.graph_objects as go 
 from datetime import datetime
+import os
+from loading import DATA_FILE, load_data, read_chunks
+import snapshots
+import warmup
+import profiling
+import static_assets
+from forecasting import describe_config, load_best_configs
+from compute import cached_aggregates, data_fingerprint, stream_aggregates
 
 #Upload Data
-data = (
-    pd.read_csv("PolinaExport07042023.csv") # Upload new data file (replace "PolinaExport07042023.csv" with the path to your data file)
-    .assign(ScreeningDate=lambda data: pd.to_datetime(data["ScreeningDate"], format="%m/%d/%Y")) # Convert "ScreeningDate" column to datetime format
-    .rename(columns={"PtDatabase::CommJailEnrollment": "EnrollmentType"}) # Rename column "PtDatabase::CommJailEnrollment" to "EnrollmentType"
-    .sort_values(by="ScreeningDate") # Sort the data by "ScreeningDate"
-)
-
-# Created a new variable that is true or false for enrollemnt and that is being used as a filter for the enrolled cards and graphs 
-data['Enrolled']=data["PtDatabase::EnrollmentDate"].notna() & (data['PtDatabase::PIDStatus'] != 'Not Released in 90 Days') & (data['PtDatabase::PIDStatus'] != 'Did Not Complete BL')
+forecast_configs = load_best_configs() # Best forecast model per filter combination, written by backtest.py
+precomputed_aggregates = None # Aggregates per filter combination in the snapshot and streaming modes
+precomputed_failures = {} # Error of each filter combination whose aggregates could not be finished in those modes
+
+# Set SNAPSHOT_DIR to a directory of dated exports to apply only the changes between successive snapshots
+# (new snapshots are picked up every SNAPSHOT_REFRESH_SECONDS while the dashboard runs)
+# Set STREAM_CHUNKSIZE to aggregate a large export in chunks of that many rows without keeping its rows in memory
+if os.environ.get("SNAPSHOT_DIR"):
+    data = None
+    snapshot_state = snapshots.ingest_directory(os.environ["SNAPSHOT_DIR"], forecast_configs)
+    precomputed_aggregates = snapshot_state["aggregates"] # Updated in place when new snapshots are applied
+    precomputed_failures = snapshot_state["failed"]
+elif os.environ.get("STREAM_CHUNKSIZE"):
+    data = None
+    precomputed_aggregates, precomputed_failures = stream_aggregates(read_chunks(DATA_FILE, int(os.environ["STREAM_CHUNKSIZE"])), forecast_configs)
+else:
+    data = load_data(DATA_FILE) # Upload the data file (set DATA_FILE in loading.py to the path of your data file)
 
 # Get options for dropdowns
-sites = pd.Series(data["Site"].sort_values().unique()).dropna() # Get unique sites from the "Site" column and remove any missing values
+if data is None:
+    # Sites and enrollment types with data (new ones in later snapshots appear after a restart)
+    combinations = set(precomputed_aggregates) | set(precomputed_failures)
+    sites = pd.Series(sorted({site for site, _ in combinations} - {"All"}))
+    enrollment_statuses = pd.Series(sorted({enrollment_status for _, enrollment_status in combinations} - {"All"}))
+else:
+    sites = pd.Series(data["Site"].sort_values().unique()).dropna() # Get unique sites from the "Site" column and remove any missing values
+    enrollment_statuses = pd.Series(data["EnrollmentType"].sort_values().unique()).dropna() # Get unique enrollment types and remove any missing values
 options = [{"label": "All", "value": slice(None)}] + [  # Create options for the dropdown menu
     {"label": site, "value": site} # Each option has a label and value corresponding to a site
     for site in sites
 ]
 
-enrollment_statuses = pd.Series(data["EnrollmentType"].sort_values().unique()).dropna() # Get unique enrollment types and remove any missing values
+data_key = None if data is None else data_fingerprint(data) # Identifies this data in the on-disk result cache
 
-external_stylesheets = [ # List of external style sheets for the Dash app
-    {
-        "href": (
-            "https://fonts.googleapis.com/css2?"
-            "family=Lato:wght@400;700&display=swap" # Link to Google Fonts for Lato font styles
-        ),
-        "rel": "stylesheet",
-    },
-    "style.css", # Additional style sheet named "style.css"
-]
-app = Dash(__name__, external_stylesheets=external_stylesheets) # Create a Dash app with the specified external stylesheets
+# Use the self-hosted, fingerprinted assets when they have been built with build_assets.py
+manifest = static_assets.load_manifest()
+if manifest:
+    external_stylesheets = [static_assets.asset_url(manifest, "style.css")] # Vendored Lato font bundled with style.css
+    logo_src = static_assets.asset_url(manifest, "tcn_logo.png") # Resized and optimized logo
+else:
+    external_stylesheets = [ # List of external style sheets for the Dash app
+        {
+            "href": (
+                "https://fonts.googleapis.com/css2?"
+                "family=Lato:wght@400;700&display=swap" # Link to Google Fonts for Lato font styles
+            ),
+            "rel": "stylesheet",
+        },
+        "style.css", # Additional style sheet named "style.css"
+    ]
+    logo_src = "/assets/tcn_logo.png"
+app = Dash(
+    __name__,
+    external_stylesheets=external_stylesheets, # Create a Dash app with the specified external stylesheets
+    assets_ignore=r"style\.css" if manifest else "", # The built stylesheet already contains assets/style.css
+)
 app.title = "TCN PATHS" # Set the title of the Dash app to "TCN PATHS"
+server = app.server # Flask server, also used for the /ready endpoint
+static_assets.register_static_route(server) # Serve the built assets with long-lived cache headers
 
 # Layout of dashboard, organized into html divisions
 
@@ -49,7 +84,7 @@ header = html.Div(
     children=[
         html.Div(
             children=[
-                html.Img(src="/assets/tcn_logo.png", className="header-logo"), # Display the TCN logo
+                html.Img(src=logo_src, className="header-logo"), # Display the TCN logo
             ],
             className="header-logo-container",
         ),
@@ -151,7 +186,7 @@ conversion_rate_card = html.Div(
 # ARIMA enrollment projections card
 arima_enrollment_card = html.Div(
     children=[
-        html.Div("ARIMA - Enrollment Projections", className="data-card-title"),  # Title for ARIMA enrollment projections card
+        html.Div("Enrollment Projections", id="arima-enrollment-card-title", className="data-card-title"),  # Title for ARIMA enrollment projections card (names the model of the selected filters)
         html.Div(id="arima-enrollment-card-value", className="data-card-value"),  # Placeholder for ARIMA enrollment projections card value
         html.Div("Forecast for the next 3 months", style={"font-size": "12px"}),  # Description for ARIMA enrollment projections card
     ],
@@ -298,25 +333,29 @@ app.layout = html.Div(
     Output("site-card-value", "children"),# Site card 
     Output("conversion-rate-card-value", "children"),  # Conversion rate card
     Output("arima-enrollment-card-value", "children"),  # ARIMA enrollment projections card
+    Output("arima-enrollment-card-title", "children"),  # Forecast model in the ARIMA enrollment projections card title
 
     #Update outputs based on filters 
     Input("site-filter", "value"), # Graphs change based on site filter
     Input("enrollment-status-filter", "value"), # Graphs change based on enrollment filter
 )
+@profiling.profiled # Profile the callback when requested (see profiling.py)
 # Update graph based on the site and enrollment status filters 
 def update_charts(site, enrollment_status):
-    query_args = []
-    if site != "All":
-        query_args.append("Site == @site") # Add filter condition for site if it's not "All"
-    if enrollment_status != "All":
-        query_args.append("`EnrollmentType` == @enrollment_status") # Add filter condition for enrollment status if it's not "All"
-
-    if query_args == []:
-        filtered_data = data # If no filter conditions, use the original data
-        data_available = True  # Set data availability flag to True
+    # Return the outputs computed during the startup pre-warm if available (not when profiling the computation)
+    if (site, enrollment_status) in warmup.cache and not profiling.requested():
+        return warmup.cache[(site, enrollment_status)]
+
+    # Aggregates and forecast for the filters, shared with the notebook through the on-disk cache (see compute.py)
+    # (a profiled request always computes them, so the profile shows the pandas and statsmodels work; in the
+    # snapshot and streaming modes they are computed at startup, so the profile only shows the figures being built)
+    if precomputed_aggregates is not None:
+        if (site, enrollment_status) in precomputed_failures: # Fails like the computation would in the full-load mode
+            raise RuntimeError(f"Aggregates for {site}, {enrollment_status} failed: {precomputed_failures[(site, enrollment_status)]}")
+        aggregates = precomputed_aggregates.get((site, enrollment_status)) # Computed from the snapshots or while streaming
     else:
-        filtered_data = data.query(" and ".join(query_args)) # Apply the filter conditions to the data
-        data_available = len(filtered_data) > 0  # Check if data is available
+        aggregates = cached_aggregates(data, site, enrollment_status, forecast_configs, fingerprint=data_key, use_cache=not profiling.requested())
+    data_available = aggregates is not None  # Check if data is available
 
     if not data_available: # If no matching records found
         return (
@@ -335,29 +374,12 @@ def update_charts(site, enrollment_status):
             "No matching records found", # Return message for site
             "NA", # Return "NA" for conversion rate
             "NA", # Return "NA" for ARIMA
+            "Enrollment Projections", # Return the card title without a model
         )
 
 ## Screening Date chart 
-    # Group by month and count the occurrences
-    data_2022=filtered_data[filtered_data["ScreeningDate"] >= "2022-01-01"]
-    data_2021=filtered_data[filtered_data["ScreeningDate"] < "2022-01-01"]
-    screening_date_counts = data_2022["ScreeningDate"].dt.to_period('M').value_counts().sort_index()
-    screening_date_counts_2021=len(data_2021)
-    # Generate a range of months from the minimum to maximum dates
-    # min_date = data_2022["ScreeningDate"].min().to_period('M')
-    # max_date = data_2022["ScreeningDate"].max().to_period('M')
-    min_date="2022-01"
-    max_date=pd.to_datetime(data["PtDatabase::EnrollmentDate"]).max().to_period('M')
-    months = pd.period_range(min_date, max_date, freq='M')
-    dates=["2021 (all)"]+list(months.astype(str))
-    # Initialize an array to hold the count values
-    values = np.zeros(len(months)+1, dtype=int)
-    # Fill in the count values for existing months
-    # Prepend with value for 2021
-    values[0]=screening_date_counts_2021
-    for i, month in enumerate(months):
-        if month in screening_date_counts.index:
-            values[i+1] = screening_date_counts[month]
+    # Count for each month, with all of 2021 in the first bar
+    dates, values = aggregates["screening_dates"], aggregates["screening_counts"]
 # graph
     screening_date_chart_figure = {
     "data": [
@@ -393,24 +415,8 @@ def update_charts(site, enrollment_status):
 
 
 ## Enrolled Date chart 
-    # Convert "PtDatabase::EnrollmentDate" column to datetime format
-    filtered_data["PtDatabase::EnrollmentDate"] = pd.to_datetime(filtered_data["PtDatabase::EnrollmentDate"])
-    # Group by month and count the occurrences
-    data_2022 = filtered_data.loc[(filtered_data["PtDatabase::EnrollmentDate"] >= pd.to_datetime("2022-01-01")) & (filtered_data['Enrolled'])]
-    data_2021 = filtered_data.loc[(filtered_data["PtDatabase::EnrollmentDate"] < pd.to_datetime("2022-01-01")) & (filtered_data['Enrolled'])]
-    enrolled_date_counts = data_2022["PtDatabase::EnrollmentDate"].dt.to_period('M').value_counts().sort_index()
-    enrolled_date_counts_2021 = len(data_2021)
-    # Generate a range of months from the minimum to maximum dates, starting in 2022
-    max_date=pd.to_datetime(data["PtDatabase::EnrollmentDate"]).max().to_period('M')
-    months = pd.period_range(min_date, max_date, freq='M')
-    dates = ["2021 (all)"] + list(months.astype(str))
-    # Initialize an array to hold the count values
-    values = np.zeros(len(months) + 1, dtype=int)
-    values[0] = enrolled_date_counts_2021
-    # Fill in the count values for existing months
-    for i, month in enumerate(months):
-     if month in enrolled_date_counts.index:
-        values[i + 1] = enrolled_date_counts[month]
+    # Count for each month, with all of 2021 in the first bar
+    dates, values = aggregates["enrolled_dates"], aggregates["enrolled_counts"]
 # graph
     enrolled_date_chart_figure = {
     "data": [
@@ -447,24 +453,10 @@ def update_charts(site, enrollment_status):
 
 
 ## ARIMA - enrollment projection
-    # Get all enrollment counts for each month
-    all_date_counts = data_2022["PtDatabase::EnrollmentDate"].dt.to_period('M').value_counts().sort_index()
-    # Generate a range of months from the minimum to maximum dates
-    months = pd.period_range(min_date, max_date, freq='M')
-    # Fill in the count values for months with zero
-    for i, month in enumerate(months):
-        if month not in all_date_counts.index:
-            all_date_counts[month]=0
-    # Resort months
-    all_date_counts=all_date_counts.sort_index()
-    # Map individual counts to running sum of enrollment counts
-    all_date_counts[0]+=enrolled_date_counts_2021
-    for i in range(1,  len(all_date_counts)):
-        all_date_counts[i]=all_date_counts[i]+all_date_counts[i-1]
-    # Create arima model and forecast
-    model = ARIMA(all_date_counts, order=(1, 1, 1))
-    model_fit = model.fit()
-    forecast = model_fit.forecast(steps=3)
+    # Running sum of enrollment counts for each month and its forecast
+    all_date_counts = aggregates["cumulative_enrollment"]
+    forecast = aggregates["forecast"]
+    forecast_config = aggregates["forecast_config"]
 # graph
     arima_enrollment_chart_figure = {
         "data": [
@@ -484,12 +476,12 @@ def update_charts(site, enrollment_status):
         },
         ],
         "layout": {
-        "title": {"text": "Enrollment Forecast (ARIMA)", "x": 0.05, "xanchor": "left"},
+        "title": {"text": f"Enrollment Forecast ({describe_config(forecast_config)})", "x": 0.05, "xanchor": "left"},
         "xaxis": {"fixedrange": True},
         "yaxis": {"title": "Enrollment", "fixedrange": True},
         "annotations": [
             {
-                "text": "Enrollment Forecast (ARIMA) predicts the enrolled counts for the next three months.",
+                "text": f"Enrollment Forecast ({describe_config(forecast_config)}) predicts the enrolled counts for the next three months.",
                 "xref": "paper",
                 "yref": "paper",
                 "x": 0,
@@ -503,7 +495,7 @@ def update_charts(site, enrollment_status):
     }
 
  ## Enrollment Count/Type chart
-    enrollment_counts = filtered_data[filtered_data['Enrolled']]["EnrollmentType"].value_counts()
+    enrollment_counts = aggregates["enrollment_counts"]
 # graph
     enrollment_chart_figure = {
         "data": [
@@ -538,7 +530,7 @@ def update_charts(site, enrollment_status):
 
 
     ## PID Status chart
-    pid_status_counts = filtered_data[filtered_data['Enrolled']]["PtDatabase::PIDStatus"].value_counts()
+    pid_status_counts = aggregates["pid_status_counts"]
 # graph
     pid_status_chart_figure = {
         "data": [
@@ -572,7 +564,7 @@ def update_charts(site, enrollment_status):
     }
 
 ## Referral Source chart
-    referral_source_counts = filtered_data["ReferralSource"].value_counts()
+    referral_source_counts = aggregates["referral_source_counts"]
 # graph
     referral_source_chart_figure = {
     "data": [
@@ -607,7 +599,7 @@ def update_charts(site, enrollment_status):
     
 
     # MOUDType for enrolled -  PtDatabase::EnrollmentDate
-    moudtype_counts = filtered_data[filtered_data['Enrolled']]["MOUDType"].value_counts()
+    moudtype_counts = aggregates["moudtype_counts"]
 # graph
     moudtype_enrolled_graph = {
     "data": [
@@ -642,7 +634,7 @@ def update_charts(site, enrollment_status):
 
 
 # OUDScore - bar graph (for each of the scores (how many per score value))
-    oudscore_counts = filtered_data["OUDScore"].value_counts()
+    oudscore_counts = aggregates["oudscore_counts"]
 # graph
     oudscore_graph = {
     "data": [
@@ -683,8 +675,7 @@ def update_charts(site, enrollment_status):
 
 # DaysIncarcerated 
     # Filter the data absolute values (no negative)
-    filtered_days_incarcerated = filtered_data["DaysIncarcerated"].copy()
-    filtered_days_incarcerated = abs(filtered_days_incarcerated)
+    filtered_days_incarcerated = aggregates["days_incarcerated"]
     #filtered_days_incarcerated[filtered_days_incarcerated > 1095] = 1095 # Outliers above 3 years are brought to the top of the box plot
 # graph
     days_incarcerated_graph = {
@@ -731,38 +722,32 @@ def update_charts(site, enrollment_status):
 ## Cards ##
 
     ## Update age mean card
-    age_mean = round(filtered_data["Age"].mean())
+    age_mean = aggregates["age_mean"]
 
     ## Update race card
-    race_counts = filtered_data["Race"].value_counts()
+    race_counts = aggregates["race_counts"]
     race_lines = [
         html.Div(f"{race}: {count}", style={"marginBottom": "5px"})
         for race, count in race_counts.items()
     ]
 
     ## Update gender card
-    gender_counts = filtered_data["Gender"].value_counts()
+    gender_counts = aggregates["gender_counts"]
     gender_lines = [
         html.Div(f"{gender}: {count}", style={"marginBottom": "5px"})
         for gender, count in gender_counts.items()
     ]
    
     ## Update conversion rate card
-    # Calculate the total number of screened participants
-    total_screened = len(filtered_data["ScreeningDate"].dropna())
-
-    # Calculate the number of participants who converted from screening to enrollment
-    converted_participants = len(filtered_data[(filtered_data["Enrolled"]) & (filtered_data["ScreeningDate"].notna())])
-
-    # Calculate the conversion rate and round it to 0 decimal places
-    conversion_rate = round((converted_participants / total_screened) * 100)
+    # Percentage of screened participants who converted to enrollment, rounded to 0 decimal places
+    conversion_rate = aggregates["conversion_rate"]
 
     # Update conversion rate card
     conversion_rate_card_value = f"{conversion_rate}%"
 
 
     # Update site card
-    site_counts = filtered_data[filtered_data['Enrolled']]["Site"].value_counts()
+    site_counts = aggregates["site_counts"]
     total_enrollment = site_counts.sum()  # Calculate total enrollment based on site counts
 
     site_count_text = [
@@ -799,13 +784,34 @@ def update_charts(site, enrollment_status):
         gender_lines,
         site_count_text,
         conversion_rate_card_value,
-        arima_enrollment_card
+        arima_enrollment_card,
+        f"{describe_config(forecast_config)} - Enrollment Projections"
     )
 
 # Function for the blank graph  when there are no matching records
 def blank_figure():
     return {"data": [], "layout": {}}
 
+# Pre-warm the outputs of every filter combination (concurrently, on threads) and report progress on /ready
+# (set PREWARM=0 to skip, e.g. when importing the dashboard in a notebook)
+prewarm = os.environ.get("PREWARM", "1") != "0"
+warmup.register_ready_endpoint(server, prewarm)
+profiling.register_admin_pages(server) # Recent callback profiles on /admin/profiles
+if prewarm: # Combinations whose aggregates failed in the snapshot and streaming modes are listed as failed
+    warmup.start_prewarm(update_charts, warmup.filter_combinations(sites, enrollment_statuses))
+
+# Apply new snapshots while running: drop the pre-warmed outputs and failures of the combinations
+# they changed, and list the combinations that failed again
+def forget_changed(changed):
+    warmup.forget(changed)
+    if not prewarm:
+        return
+    for combination in changed & set(precomputed_failures):
+        warmup.record_failure(combination, precomputed_failures[combination])
+
+if os.environ.get("SNAPSHOT_DIR"):
+    snapshots.start_refresh(snapshot_state, forecast_configs, int(os.environ.get("SNAPSHOT_REFRESH_SECONDS", 3600)), forget_changed)
+
 # Print the local URL
 if __name__ == "__main__":
     app.run_server(debug=True, port=8052)
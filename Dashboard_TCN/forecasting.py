@@ -0,0 +1,80 @@
+#Libraries
+import json
+import os
+import warnings
+import pandas as pd
+from statsmodels.tsa.arima.model import ARIMA
+from statsmodels.tsa.holtwinters import ExponentialSmoothing
+from statsmodels.tools.sm_exceptions import ConvergenceWarning, EstimationWarning
+
+# Convergence and starting-parameter warnings are expected on short, sparse series. They are filtered
+# once here: warnings.catch_warnings() is not thread-safe, and fits run on the pre-warm threads
+warnings.filterwarnings("ignore", category=ConvergenceWarning)
+warnings.filterwarnings("ignore", category=EstimationWarning)
+warnings.filterwarnings("ignore", category=RuntimeWarning, module="statsmodels.tsa.holtwinters")
+
+MIN_MONTH = "2022-01" # Months before are summed into the first value of the series
+FORECAST_STEPS = 3 # Number of months forecasted on the dashboard
+DEFAULT_CONFIG = {"model": "arima", "order": [1, 1, 1]} # Used for series without a backtested configuration
+BEST_CONFIG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "forecast_config.json") # Written by backtest.py
+
+
+# Build the monthly cumulative enrollment series for the filtered data, from MIN_MONTH to max_date
+def enrollment_series(filtered_data, max_date):
+    enrollment_dates = pd.to_datetime(filtered_data.loc[filtered_data["Enrolled"], "PtDatabase::EnrollmentDate"])
+    return cumulative_series(enrollment_dates.dt.to_period('M').value_counts(), max_date)
+
+
+# Same series from enrollment counts per month (e.g. summed over chunks of the data)
+def cumulative_series(month_counts, max_date):
+    # Enrollments before MIN_MONTH are all counted in the first month
+    enrolled_2021 = month_counts[month_counts.index < pd.Period(MIN_MONTH, freq='M')].sum()
+    # Enrollment counts for each month, with zero for months without enrollments
+    months = pd.period_range(MIN_MONTH, max_date, freq='M')
+    # Map individual counts to running sum of enrollment counts
+    return month_counts.reindex(months, fill_value=0).cumsum() + enrolled_2021
+
+
+# Fit the model described by a configuration and forecast the next months
+def fit_forecast(series, config, steps=FORECAST_STEPS):
+    if config["model"] == "arima":
+        model_fit = ARIMA(series, order=tuple(config["order"])).fit()
+    elif config["model"] == "holt_winters":
+        model_fit = ExponentialSmoothing(
+            series.astype(float),
+            trend=config.get("trend"),
+            damped_trend=config.get("damped", False),
+            seasonal=config.get("seasonal"),
+            seasonal_periods=12 if config.get("seasonal") else None,
+        ).fit()
+    else:
+        raise ValueError(f"Unknown forecast model: {config['model']}")
+    return model_fit.forecast(steps=steps)
+
+
+# Short name of a configuration for chart titles and reports
+def describe_config(config):
+    if config["model"] == "arima":
+        return f"ARIMA{tuple(config['order'])}"
+    options = []
+    if config.get("trend"):
+        options.append(("damped " if config.get("damped") else "") + config["trend"] + " trend")
+    if config.get("seasonal"):
+        options.append(config["seasonal"] + " seasonal")
+    return "Holt-Winters" + (f" ({', '.join(options)})" if options else "")
+
+
+def config_key(site, enrollment_status):
+    return f"{site}|{enrollment_status}"
+
+
+# Load the best configuration per series found by backtest.py
+def load_best_configs(path=BEST_CONFIG_FILE):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as config_file:
+        return json.load(config_file)
+
+
+def config_for(configs, site, enrollment_status):
+    return configs.get(config_key(site, enrollment_status), DEFAULT_CONFIG)
@@ -0,0 +1,55 @@
+#Libraries
+import pandas as pd
+
+# Default data file (replace "PolinaExport07042023.csv" with the path to your data file)
+DATA_FILE = "PolinaExport07042023.csv"
+
+
+# Columns of the export used by the dashboard (the other columns are skipped by the streaming mode)
+DASHBOARD_COLUMNS = [
+    "PID", "Site", "ScreeningDate", "Race", "Gender", "MOUDType", "ReferralSource", "DaysIncarcerated", "Age",
+    "OUDScore", "PtDatabase::PIDStatus", "PtDatabase::CommJailEnrollment", "PtDatabase::EnrollmentDate",
+]
+CHUNK_SIZE = 50000 # Rows read at a time by the streaming mode
+
+
+# Apply the dashboard's type conversions and derived columns to a raw export (or a chunk of one)
+def convert_types(raw):
+    data = (
+        raw
+        .assign(ScreeningDate=lambda data: pd.to_datetime(data["ScreeningDate"], format="%m/%d/%Y")) # Convert "ScreeningDate" column to datetime format
+        .rename(columns={"PtDatabase::CommJailEnrollment": "EnrollmentType"}) # Rename column "PtDatabase::CommJailEnrollment" to "EnrollmentType"
+    )
+
+    # Created a new variable that is true or false for enrollemnt and that is being used as a filter for the enrolled cards and graphs
+    data['Enrolled']=data["PtDatabase::EnrollmentDate"].notna() & (data['PtDatabase::PIDStatus'] != 'Not Released in 90 Days') & (data['PtDatabase::PIDStatus'] != 'Did Not Complete BL')
+    return data
+
+
+def prepare_data(raw):
+    return convert_types(raw).sort_values(by="ScreeningDate") # Sort the data by "ScreeningDate"
+
+
+# Read a single export file and prepare it for the dashboard
+def load_data(path=DATA_FILE):
+    return prepare_data(pd.read_csv(path))
+
+
+# Read a large export in chunks of converted rows (skipping the columns the dashboard does not use),
+# to be aggregated one chunk at a time by compute.stream_aggregates
+def read_chunks(path=DATA_FILE, chunksize=CHUNK_SIZE):
+    for raw in pd.read_csv(path, usecols=DASHBOARD_COLUMNS, chunksize=chunksize):
+        yield convert_types(raw)
+
+
+# Filter the data on the dashboard's site and enrollment status dropdown values ("All" keeps everything)
+def filter_data(data, site, enrollment_status):
+    query_args = []
+    if site != "All":
+        query_args.append("Site == @site") # Add filter condition for site if it's not "All"
+    if enrollment_status != "All":
+        query_args.append("`EnrollmentType` == @enrollment_status") # Add filter condition for enrollment status if it's not "All"
+
+    if query_args == []:
+        return data # If no filter conditions, use the original data
+    return data.query(" and ".join(query_args)) # Apply the filter conditions to the data
@@ -0,0 +1,88 @@
+#Libraries
+import cProfile
+import functools
+import html
+import io
+import os
+import pstats
+from datetime import datetime
+from urllib.parse import parse_qs, urlparse
+from flask import abort, has_request_context, request
+
+# Opt-in profiling of the dashboard callbacks:
+#   PROFILE_CALLBACKS=1 enables it, then a request is profiled when it sends the "X-Profile: 1" header
+#   or when the dashboard page was opened with "?profile=1" (callbacks see it through the referrer)
+PROFILE_DIR = os.environ.get("PROFILE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "profiles")) # Directory where the profiles are saved
+RECENT_PROFILES = 50 # Number of profiles kept (older ones are deleted) and listed on the admin page
+
+
+def enabled():
+    return os.environ.get("PROFILE_CALLBACKS") == "1"
+
+
+# Check whether the current request asked to be profiled
+def requested():
+    if not enabled() or not has_request_context():
+        return False
+    if request.headers.get("X-Profile") == "1" or request.args.get("profile") == "1":
+        return True
+    referrer_query = parse_qs(urlparse(request.referrer or "").query)
+    return referrer_query.get("profile") == ["1"]
+
+
+# Decorator that runs the callback under cProfile when profiling is requested and saves the stats
+def profiled(function):
+    @functools.wraps(function)
+    def wrapper(*args):
+        if not requested():
+            return function(*args)
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(function, *args)
+        finally:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            name = "_".join([datetime.now().strftime("%Y%m%d-%H%M%S-%f"), function.__name__] + [str(arg) for arg in args])
+            profiler.dump_stats(os.path.join(PROFILE_DIR, "".join(c if c.isalnum() or c in "-_" else "-" for c in name) + ".prof"))
+            prune_profiles()
+    return wrapper
+
+
+# Profile files, newest first (names start with their timestamp)
+def all_profiles():
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    return sorted((name for name in os.listdir(PROFILE_DIR) if name.endswith(".prof")), reverse=True)
+
+
+def recent_profiles():
+    return all_profiles()[:RECENT_PROFILES]
+
+
+# Delete the profiles beyond the most recent ones so the directory does not grow without bound
+def prune_profiles():
+    for name in all_profiles()[RECENT_PROFILES:]:
+        try:
+            os.remove(os.path.join(PROFILE_DIR, name))
+        except FileNotFoundError:
+            pass # Already deleted by a concurrent request
+
+
+# Admin pages listing the recent profiles and showing the top functions of each one
+def register_admin_pages(server):
+    @server.route("/admin/profiles")
+    def profiles():
+        if not enabled():
+            abort(404)
+        items = "".join(
+            f'<li><a href="/admin/profiles/{html.escape(name)}">{html.escape(name)}</a></li>'
+            for name in recent_profiles()
+        )
+        return f"<h1>Recent profiles</h1><ul>{items or '<li>No profiles yet</li>'}</ul>"
+
+    @server.route("/admin/profiles/<name>")
+    def profile(name):
+        if not enabled() or name not in recent_profiles():
+            abort(404)
+        stream = io.StringIO()
+        pstats.Stats(os.path.join(PROFILE_DIR, name), stream=stream).sort_stats("cumulative").print_stats(40)
+        return f"<h1>{html.escape(name)}</h1><pre>{html.escape(stream.getvalue())}</pre>"
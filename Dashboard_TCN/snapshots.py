@@ -0,0 +1,227 @@
+#Libraries
+import json
+import logging
+import os
+import re
+import threading
+import time
+from datetime import datetime
+import pandas as pd
+from compute import combine_partials, finish_all, partial_aggregates, partial_max_date
+from loading import prepare_data
+
+logger = logging.getLogger(__name__)
+
+# Each export is a full snapshot of the data; only the participants that changed between
+# two snapshots (hashed by "PID") are applied to the data and to the aggregates already in memory:
+# the partial aggregates of their old rows are subtracted, those of their new rows added, and only
+# the filter combinations they touch are finished (and forecast) again
+
+# Both files are kept in the snapshot directory
+STATE_FILE = "snapshot_state.json" # Processed snapshots, so a restart starts from the last one
+HISTORY_FILE = "change_history.csv" # One line per inserted, updated or removed participant
+
+# Snapshot files are dated like the exports, e.g. "PolinaExport07042023.csv" (MMDDYYYY)
+SNAPSHOT_DATE = re.compile(r"(\d{8})")
+
+
+# Get the (date, path) of every dated CSV snapshot in the directory, oldest first
+def snapshot_files(directory):
+    snapshots = []
+    for name in os.listdir(directory):
+        match = SNAPSHOT_DATE.search(name)
+        if not name.endswith(".csv") or match is None:
+            continue # Skip files that are not dated exports
+        try:
+            date = datetime.strptime(match.group(1), "%m%d%Y")
+        except ValueError:
+            continue # Eight digits that are not a date
+        snapshots.append((date, os.path.join(directory, name)))
+    return sorted(snapshots)
+
+
+# Hash every row of a raw snapshot, indexed by "PID". The rows are hashed as read from the file (text),
+# since the dtypes read_csv infers can change between snapshots without any value changing (e.g. "Age"
+# becomes int64 once its last blank is filled), which would mark every row as updated
+def row_hashes(text, pids):
+    duplicated = pids[pids.duplicated()].unique()
+    if len(duplicated) > 0: # Rows are matched between snapshots by PID, so it must identify one row
+        raise ValueError(f"Duplicate PID values in snapshot: {', '.join(map(str, duplicated[:10]))}")
+    hashes = pd.util.hash_pandas_object(text, index=False)
+    hashes.index = pids
+    return hashes
+
+
+# Read a snapshot twice: with the inferred dtypes (to be prepared for the dashboard) and as text (to be
+# hashed). Returns the raw rows and their hashes, indexed by the same (typed) "PID" values as the data
+def read_snapshot(path):
+    raw = pd.read_csv(path)
+    return raw, row_hashes(pd.read_csv(path, dtype=str), raw["PID"])
+
+
+# Compare the row hashes of two snapshots and return the inserted, updated and removed PIDs
+def diff_snapshots(old_hashes, new_hashes):
+    common = new_hashes.index.intersection(old_hashes.index)
+    changed = new_hashes[common].values != old_hashes[common].values
+    return {
+        "inserted": new_hashes.index.difference(old_hashes.index),
+        "updated": common[changed],
+        "removed": old_hashes.index.difference(new_hashes.index),
+    }
+
+
+# Apply a delta to the prepared data: drop removed and updated rows, add the new versions
+def apply_delta(data, raw, delta):
+    replaced = delta["updated"].union(delta["removed"])
+    added = raw[raw["PID"].isin(delta["inserted"].union(delta["updated"]))]
+    if len(added) == 0:
+        return data[~data["PID"].isin(replaced)].reset_index(drop=True)
+    return (
+        pd.concat([data[~data["PID"].isin(replaced)], prepare_data(added)], ignore_index=True)
+        .sort_values(by="ScreeningDate") # Keep the data sorted by "ScreeningDate" like a full load
+    )
+
+
+# Append the delta of one snapshot to the change history file
+def record_history(delta, snapshot, date, history_file):
+    history = pd.DataFrame(
+        [
+            {"Snapshot": os.path.basename(snapshot), "SnapshotDate": date.strftime("%Y-%m-%d"), "PID": pid, "Change": change}
+            for change, pids in delta.items()
+            for pid in pids
+        ],
+        columns=["Snapshot", "SnapshotDate", "PID", "Change"],
+    )
+    history.to_csv(history_file, mode="a", index=False, header=not os.path.exists(history_file))
+
+
+# Snapshots of the directory not applied yet (newer than the last one applied)
+def new_snapshots(state):
+    return [
+        (date, path)
+        for date, path in snapshot_files(state["directory"])
+        if os.path.basename(path) not in state["processed"] and (state["last_date"] is None or date >= state["last_date"])
+    ]
+
+
+# Load one snapshot as the base of the state (a full load: data, row hashes and partial aggregates)
+def load_base(state, path):
+    raw, state["hashes"] = read_snapshot(path)
+    state["data"] = prepare_data(raw)
+    state["partials"] = partial_aggregates(state["data"])
+
+
+# Apply one newer snapshot to the state and return the filter combinations it changed
+def apply_snapshot(state, date, path):
+    raw, hashes = read_snapshot(path)
+    delta = diff_snapshots(state["hashes"], hashes)
+    old_rows = state["data"][state["data"]["PID"].isin(delta["updated"].union(delta["removed"]))]
+    new_rows = prepare_data(raw[raw["PID"].isin(delta["inserted"].union(delta["updated"]))])
+
+    # Update the aggregates with the changed rows only
+    removed_partials = partial_aggregates(old_rows)
+    added_partials = partial_aggregates(new_rows)
+    combine_partials(state["partials"], removed_partials, sign=-1)
+    combine_partials(state["partials"], added_partials)
+
+    state["data"] = apply_delta(state["data"], raw, delta)
+    state["hashes"] = hashes
+    record_history(delta, path, date, os.path.join(state["directory"], HISTORY_FILE))
+    return set(removed_partials) | set(added_partials)
+
+
+def mark_processed(state, date, path):
+    state["processed"].append(os.path.basename(path))
+    state["last_date"] = date
+    state["last_snapshot"] = os.path.basename(path)
+
+
+# Save which snapshots were processed (JSON only: the data is rebuilt from the last snapshot on restart)
+def save_state(state):
+    with open(os.path.join(state["directory"], STATE_FILE), "w") as state_file:
+        json.dump(
+            {
+                "processed": state["processed"],
+                "last_date": state["last_date"].strftime("%Y-%m-%d"),
+                "last_snapshot": state["last_snapshot"],
+            },
+            state_file,
+            indent=2,
+        )
+
+
+# Ingest a directory of dated snapshots: start from the last snapshot processed before (or the oldest
+# one), apply the newer ones as deltas and finish the aggregates of every filter combination.
+# Returns the state, whose "aggregates" (per filter combination) and "failed" (the error of each
+# combination that could not be finished) are updated in place by refresh()
+def ingest_directory(directory, forecast_configs):
+    state = {"directory": directory, "processed": [], "last_date": None, "last_snapshot": None, "pending": set()}
+    state_file = os.path.join(directory, STATE_FILE)
+    if os.path.exists(state_file):
+        with open(state_file) as saved_file:
+            saved = json.load(saved_file)
+        if os.path.exists(os.path.join(directory, saved["last_snapshot"])):
+            state.update(saved, last_date=datetime.strptime(saved["last_date"], "%Y-%m-%d"))
+            load_base(state, os.path.join(directory, saved["last_snapshot"]))
+
+    snapshots = new_snapshots(state)
+    if "data" not in state:
+        if not snapshots:
+            raise FileNotFoundError(f"No dated CSV snapshots found in {directory}")
+        date, path = snapshots.pop(0)
+        load_base(state, path) # First snapshot: everything is inserted
+        record_history(diff_snapshots(pd.Series(dtype="uint64"), state["hashes"]), path, date, os.path.join(directory, HISTORY_FILE))
+        mark_processed(state, date, path)
+    for date, path in snapshots:
+        apply_snapshot(state, date, path)
+        mark_processed(state, date, path)
+
+    state["aggregates"], state["failed"] = finish_all(state["partials"], forecast_configs)
+    save_state(state)
+    return state
+
+
+# Apply the snapshots added since the last ingestion and return the filter combinations whose
+# aggregates changed. Only those are finished again, unless the month range of the charts moved.
+# The changed combinations are kept in state["pending"] until they are finished, so a refresh that
+# fails after applying a snapshot finishes them on the next attempt instead of leaving them stale
+def refresh(state, forecast_configs):
+    max_date = partial_max_date(state["partials"])
+    for date, path in new_snapshots(state):
+        state["pending"] |= apply_snapshot(state, date, path)
+        mark_processed(state, date, path)
+    if partial_max_date(state["partials"]) != max_date:
+        state["pending"] |= set(state["aggregates"]) | set(state["partials"]) # Every chart covers a different range of months
+    changed = state["pending"]
+    if not changed:
+        return changed
+    changed |= set(state["failed"]) # Try the combinations that failed before again along with the new changes
+
+    finished, failed = finish_all(state["partials"], forecast_configs, [key for key in changed if key in state["partials"]])
+    state["aggregates"].update(finished)
+    for key in changed - set(finished):
+        state["aggregates"].pop(key, None) # No rows left for this combination, or its forecast failed
+    for key in changed:
+        state["failed"].pop(key, None)
+    state["failed"].update(failed)
+    state["pending"] = set()
+    save_state(state)
+    return changed
+
+
+# Check the directory for new snapshots every interval seconds in the background, calling
+# on_change with the changed filter combinations after each refresh that changed something
+def start_refresh(state, forecast_configs, interval, on_change):
+    def refresh_loop():
+        while True:
+            time.sleep(interval)
+            try:
+                changed = refresh(state, forecast_configs)
+            except Exception: # e.g. a malformed snapshot: keep serving the current aggregates
+                logger.exception("Snapshot refresh failed")
+                continue
+            if changed:
+                on_change(changed)
+    thread = threading.Thread(target=refresh_loop, daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,41 @@
+#Libraries
+import json
+import mimetypes
+import os
+from flask import request, send_from_directory
+
+# Fingerprinted and precompressed assets written by build_assets.py
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+STATIC_URL = "/static-assets/"
+MANIFEST_FILE = "manifest.json" # Maps each source asset name to its fingerprinted file name
+CACHE_CONTROL = "public, max-age=31536000, immutable" # File names change with their content, so cache for a year
+
+
+# Load the asset manifest, or an empty one when the assets have not been built
+def load_manifest():
+    path = os.path.join(STATIC_DIR, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as manifest_file:
+        return json.load(manifest_file)
+
+
+def asset_url(manifest, name):
+    return STATIC_URL + manifest[name]
+
+
+# Serve the built assets with long-lived cache headers, using the precompressed file the browser accepts
+def register_static_route(server):
+    @server.route(STATIC_URL + "<path:filename>")
+    def static_asset(filename):
+        accepted = request.headers.get("Accept-Encoding", "")
+        for encoding, suffix in (("br", ".br"), ("gzip", ".gz")):
+            if encoding in accepted and os.path.exists(os.path.join(STATIC_DIR, filename + suffix)):
+                response = send_from_directory(STATIC_DIR, filename + suffix, mimetype=mimetypes.guess_type(filename)[0])
+                response.headers["Content-Encoding"] = encoding
+                break
+        else:
+            response = send_from_directory(STATIC_DIR, filename)
+        response.headers["Cache-Control"] = CACHE_CONTROL
+        response.headers["Vary"] = "Accept-Encoding"
+        return response
@@ -0,0 +1,81 @@
+#Libraries
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import jsonify
+
+# Outputs of the dashboard callback for each (site, enrollment status) filter combination,
+# computed at startup so the first view of every combination is a cache hit
+cache = {}
+
+# Warm-up progress reported by the /ready endpoint
+progress = {"total": 0, "done": 0, "failed": []}
+progress_lock = threading.Lock()
+
+
+# Every combination of the dropdown values, including "All"
+def filter_combinations(sites, enrollment_statuses):
+    return [
+        (site, enrollment_status)
+        for site in ["All"] + list(sites)
+        for enrollment_status in ["All"] + list(enrollment_statuses)
+    ]
+
+
+# List a filter combination that could not be computed under "failed" on /ready
+def record_failure(combination, error):
+    with progress_lock:
+        progress["failed"].append({"site": combination[0], "enrollment_status": combination[1], "error": str(error)})
+
+
+# Drop the cached outputs and recorded failures of combinations whose data changed
+def forget(combinations):
+    for combination in combinations:
+        cache.pop(combination, None)
+    with progress_lock:
+        progress["failed"] = [
+            failure for failure in progress["failed"]
+            if (failure["site"], failure["enrollment_status"]) not in combinations
+        ]
+
+
+# Compute and cache the outputs for one filter combination
+def warm(compute, combination):
+    try:
+        cache[combination] = compute(*combination)
+    except Exception as error: # A failed combination (e.g. the ARIMA fit) is computed again on request
+        record_failure(combination, error)
+    with progress_lock:
+        progress["done"] += 1
+
+
+# Compute the outputs for all combinations concurrently on a thread pool. The threads share the
+# data and the cache, but pandas and statsmodels only release the GIL in parts of their work, so
+# this overlaps the combinations rather than running them fully in parallel
+def prewarm(compute, combinations, workers=None):
+    with progress_lock:
+        progress["total"] = len(combinations)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for combination in combinations:
+            executor.submit(warm, compute, combination)
+
+
+# Run the pre-warm phase in the background so the server can answer /ready meanwhile
+def start_prewarm(compute, combinations):
+    workers = int(os.environ.get("PREWARM_WORKERS", 0)) or None # Default to the executor's worker count
+    thread = threading.Thread(target=prewarm, args=(compute, combinations, workers), daemon=True)
+    thread.start()
+    return thread
+
+
+# Readiness endpoint for the load balancer: 503 until every combination has been attempted.
+# Failed combinations count as ready (a failing fit would otherwise keep the worker out of rotation
+# forever): they are listed under "failed" and computed again when requested. Without a pre-warm
+# (prewarm=False) the worker is ready at once and computes every combination on request
+def register_ready_endpoint(server, prewarm=True):
+    @server.route("/ready")
+    def ready():
+        with progress_lock:
+            warmed = progress["total"] > 0 and progress["done"] == progress["total"]
+            status = dict(progress, warm=len(cache), ready=warmed or not prewarm)
+        return jsonify(status), 200 if status["ready"] else 503